@@ -1,27 +1,214 @@
-from openai import OpenAI
 import os
+import sys
+import argparse
+import hashlib
+import tempfile
+import contextlib
 from dotenv import load_dotenv
 from rich import print as rprint
 from rich.panel import Panel
-from prompt_toolkit import PromptSession
-from prompt_toolkit.styles import Style
-from rich.syntax import Syntax
-import pyperclip
-import time  # Add time import
-import requests
-import json
+import time
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
 # Model Constants
 DEEPSEEK_MODEL = "deepseek-reasoner"
 OPENROUTER_MODEL = "openai/gpt-4o-mini"
 OLLAMA_MODEL = "qwen2.5:14b"
 OLLAMA_DEEPSEEK = "deepseek-r1:14b"  
+OLLAMA_EMBED_MODEL = "nomic-embed-text"
+
+# Cosine similarity above which an earlier prompt's response is reused
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
+# Number of recent turns kept verbatim; older turns are folded into a summary
+HISTORY_TURNS = 8
+
+STREAM_ERROR = "Error occurred while streaming response"
 
 # Load environment variables
 load_dotenv()
 
+def _np():
+    # numpy is only needed by the semantic cache, so load it on first use
+    import numpy
+    return numpy
+
+def _discard(_piece):
+    pass
+
+def _fmt_elapsed(start: float) -> str:
+    """Format the time since a time.monotonic() reading"""
+    elapsed_time = time.monotonic() - start
+    if elapsed_time >= 60:
+        return f"{elapsed_time/60:.1f} minutes"
+    return f"{elapsed_time:.1f} seconds"
+
+class _StreamPrinter:
+    """Batch streamed tokens into fewer stdout writes
+
+    The delay threshold is only checked when the next piece arrives, so if a
+    stream pauses, up to max_bytes of text can stay buffered until it resumes
+    or the caller flushes at the end of the stream.
+    """
+
+    def __init__(self, max_bytes=256, max_delay=0.016):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.buffer = bytearray()
+        self.last_flush = time.monotonic()
+
+    def write(self, piece):
+        # Encode like print() would, so non-UTF-8 consoles are not garbled
+        self.buffer += piece.encode(sys.stdout.encoding or "utf-8", errors="replace")
+        if (
+            "\n" in piece
+            or len(self.buffer) >= self.max_bytes
+            or time.monotonic() - self.last_flush >= self.max_delay
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            # Drain text-layer output (e.g. from rich) before writing raw bytes
+            sys.stdout.flush()
+            sys.stdout.buffer.write(self.buffer)
+            sys.stdout.buffer.flush()
+            self.buffer.clear()
+        self.last_flush = time.monotonic()
+
+class _ThinkTagScanner:
+    """Incrementally split streamed text into the <think> block and what follows it
+
+    Only the new piece plus a short held-back tail is scanned for tags, so the
+    cost stays linear in the length of the stream.
+    """
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+    SEEK_OPEN, STREAMING, DONE = range(3)
+
+    def __init__(self, discard_reasoning=False):
+        # When discarding, only the tag positions are tracked and no reasoning
+        # substrings are built
+        self.discard_reasoning = discard_reasoning
+        self.state = self.SEEK_OPEN
+        self.tail = ""
+        # Text seen before any tag; it is the reasoning if a </think> comes
+        # first (the template pre-filled <think>), otherwise possibly the answer
+        self.preamble = []
+
+    @property
+    def done(self):
+        return self.state == self.DONE
+
+    def feed(self, piece):
+        """Return (reasoning, after) text that became available with piece"""
+        if self.state == self.DONE:
+            return "", piece
+        
+        text = self.tail + piece
+        self.tail = ""
+        reasoning = ""
+        
+        if self.state == self.SEEK_OPEN:
+            idx = text.find(self.OPEN_TAG)
+            close_idx = text.find(self.CLOSE_TAG)
+            if close_idx != -1 and (idx == -1 or close_idx < idx):
+                self.state = self.DONE
+                preamble, self.preamble = self.preamble, []
+                after = text[close_idx + len(self.CLOSE_TAG):]
+                if self.discard_reasoning:
+                    return "", after
+                body = "".join(preamble) + text[:close_idx]
+                return self.OPEN_TAG + body + self.CLOSE_TAG, after
+            if idx == -1:
+                # Hold back a possible partial tag of either kind
+                self.tail = self._partial_tag(text, self.CLOSE_TAG) or self._partial_tag(text, self.OPEN_TAG)
+                self.preamble.append(text[:len(text) - len(self.tail)])
+                return "", ""
+            # Text before <think> is dropped
+            self.preamble = []
+            self.state = self.STREAMING
+            reasoning = self.OPEN_TAG
+            text = text[idx + len(self.OPEN_TAG):]
+        
+        idx = text.find(self.CLOSE_TAG)
+        if idx == -1:
+            self.tail = self._partial_tag(text, self.CLOSE_TAG)
+            if self.discard_reasoning:
+                return "", ""
+            return reasoning + text[:len(text) - len(self.tail)], ""
+        
+        self.state = self.DONE
+        after = text[idx + len(self.CLOSE_TAG):]
+        if self.discard_reasoning:
+            return "", after
+        return reasoning + text[:idx] + self.CLOSE_TAG, after
+
+    def finish(self):
+        """Return the rest of the reasoning, closing the tag, when the stream ends inside <think>"""
+        tail, self.tail = self.tail, ""
+        if self.state != self.STREAMING:
+            return ""
+        self.state = self.DONE
+        if self.discard_reasoning:
+            return ""
+        return tail + self.CLOSE_TAG
+
+    def unparsed(self):
+        """Return the text seen so far when no tag has been found in it"""
+        if self.state != self.SEEK_OPEN:
+            return ""
+        return "".join(self.preamble) + self.tail
+
+    @staticmethod
+    def _partial_tag(text, tag):
+        # A partial tag must start at the last "<" within len(tag) - 1 chars of the end
+        lt = text.rfind("<", max(len(text) - len(tag) + 1, 0))
+        if lt != -1 and tag.startswith(text[lt:]):
+            return text[lt:]
+        return ""
+
+class _ResponseCache:
+    """On-disk cache of model outputs keyed by model and messages"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(model, messages):
+        payload = orjson.dumps({"model": model, "messages": messages}, option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.directory, f"{key}.json"), "rb") as f:
+                return orjson.loads(f.read())["content"]
+        except (OSError, orjson.JSONDecodeError, KeyError):
+            return None
+
+    def put(self, key, content):
+        # Best effort: a failed write must never fail the turn that produced it.
+        # Write to a temp file and rename so readers never see a partial entry
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(orjson.dumps({"content": content}))
+            os.replace(tmp_path, os.path.join(self.directory, f"{key}.json"))
+        except OSError:
+            if tmp_path is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(tmp_path)
+
+def default_cache_dir():
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "jarvis")
+
 class ModelChain:
-    def __init__(self):
+    def __init__(self, use_cache=False):
         # Initialize clients based on available API keys
         self.deepseek_api_key = os.getenv("DEEPSEEK_API_KEY")
         self.openrouter_api_key = os.getenv("OPENROUTER_API_KEY")
@@ -29,33 +216,112 @@ class ModelChain:
         self.has_official_deepseek = bool(self.deepseek_api_key)
         self.has_openrouter = bool(self.openrouter_api_key)
         
-        if self.has_official_deepseek:
-            self.deepseek_client = OpenAI(
-                api_key=self.deepseek_api_key,
-                base_url="https://api.deepseek.com"
-            )
-        
-        if self.has_openrouter:
-            # Initialize OpenRouter client
-            self.openrouter_client = OpenAI(
-                base_url="https://openrouter.ai/api/v1",
-                api_key=self.openrouter_api_key
-            )
-        
-        # Initialize Ollama client with native API path
-        self.ollama_client = OpenAI(
-            base_url="http://localhost:11434/api",
-            api_key="ollama",
-        )
+        # HTTP and API clients are created on first use (see the properties
+        # below), so startup does not pay for importing openai/httpx/requests
         
         self.deepseek_messages = []
         self.openrouter_messages = []
         self.ollama_messages = []
+        self.history_turns = HISTORY_TURNS
         # Default to Ollama model if no OpenRouter API key is available
         self.current_model = OLLAMA_MODEL if not self.has_openrouter else OPENROUTER_MODEL
         self.show_reasoning = True
         self.use_ollama_deepseek = not self.has_official_deepseek  # Default based on API availability
         self.ollama_base_url = "http://localhost:11434/api"
+        
+        # Background worker for requests that can overlap with reasoning
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.printer = _StreamPrinter()
+        # Replay identical requests from disk instead of calling the model again
+        self.cache = self._open_cache() if use_cache else None
+        # Per model: prompt embeddings (unit-normalized rows) and their responses.
+        # Prompts sent along with earlier turns are skipped, since their answer
+        # depends on that history
+        self.use_semantic_cache = use_cache
+        self.semantic_cache = {}
+
+    @cached_property
+    def http(self):
+        # Reuse one keep-alive session for all Ollama HTTP calls
+        import requests
+        from requests.adapters import HTTPAdapter
+        
+        session = requests.Session()
+        session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        return session
+
+    @cached_property
+    def http_client(self):
+        # One warm, HTTP/2-capable connection pool shared by all OpenAI clients
+        import httpx
+        
+        return httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=60.0),
+            timeout=httpx.Timeout(60.0, connect=5.0)
+        )
+
+    @cached_property
+    def deepseek_client(self):
+        from openai import OpenAI
+        
+        return OpenAI(
+            api_key=self.deepseek_api_key,
+            base_url="https://api.deepseek.com",
+            http_client=self.http_client
+        )
+
+    @cached_property
+    def openrouter_client(self):
+        from openai import OpenAI
+        
+        return OpenAI(
+            base_url="https://openrouter.ai/api/v1",
+            api_key=self.openrouter_api_key,
+            http_client=self.http_client
+        )
+
+    @cached_property
+    def ollama_client(self):
+        # Ollama client with native API path
+        from openai import OpenAI
+        
+        return OpenAI(
+            base_url="http://localhost:11434/api",
+            api_key="ollama",
+            http_client=self.http_client
+        )
+
+    def close(self):
+        """Release pooled HTTP connections"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        # Only close clients that were actually created
+        if "http" in self.__dict__:
+            self.http.close()
+        if "http_client" in self.__dict__:
+            self.http_client.close()
+
+    def _open_cache(self):
+        directory = default_cache_dir()
+        try:
+            return _ResponseCache(directory)
+        except OSError as e:
+            rprint(f"\n[red]Warning: cannot use cache directory {directory}, caching disabled: {str(e)}[/]")
+            return None
+
+    def _cache_key(self, model, messages):
+        if self.cache is None:
+            return None
+        return self.cache.key(model, messages)
+
+    def _cache_get(self, key):
+        if key is None:
+            return None
+        return self.cache.get(key)
+
+    def _cache_put(self, key, content):
+        if key is not None and content:
+            self.cache.put(key, content)
 
     def set_model(self, model_name):
         if not self.has_openrouter and not model_name.startswith("ollama:"):
@@ -65,50 +331,142 @@ class ModelChain:
             self.current_model = model_name
         self.use_ollama_deepseek = model_name.startswith("ollama:deepseek")
 
+    def has_replayed_history(self):
+        # Only the official DeepSeek and OpenRouter calls send earlier turns;
+        # the Ollama calls see just the current prompt
+        return bool(
+            (self.uses_official_deepseek() and self.deepseek_messages)
+            or (not self.uses_ollama_response() and self.openrouter_messages)
+        )
+
+    def clear_history(self):
+        self.deepseek_messages = []
+        self.openrouter_messages = []
+        self.ollama_messages = []
+
     def get_model_display_name(self):
         return self.current_model
 
-    def get_deepseek_reasoning(self, user_input):
-        start_time = time.time()
+    def answer(self, user_input):
+        """Reason about the input and respond, reusing answers to similar prompts"""
+        model = self.current_model
+        query_vec = None if self.has_replayed_history() else self._embed_prompt(user_input)
+        cached = self._find_similar_response(model, query_vec)
+        if cached is not None:
+            rprint(f"[green]{self.get_model_display_name()} (cached)[/]")
+            self.printer.write(cached)
+            self.printer.flush()
+            self.deepseek_messages.append({"role": "user", "content": user_input})
+            self.deepseek_messages.append({"role": "assistant", "content": cached})
+            self.openrouter_messages.append({"role": "user", "content": user_input})
+            self.openrouter_messages.append({"role": "assistant", "content": cached})
+            print("\n")
+            return cached
         
+        if self.uses_ollama_combined():
+            response = self.get_ollama_combined(user_input)
+        else:
+            self.preload_ollama_response_model()
+            reasoning = self.get_deepseek_reasoning(user_input)
+            response = self.get_response(user_input, reasoning)
+        # An empty answer (e.g. Ollama returned an error body) must not become a hit
+        if response and response != STREAM_ERROR:
+            self._remember_response(model, query_vec, response)
+        return response
+
+    def embed(self, text):
+        """Embed text with the local Ollama embedding model"""
+        np = _np()
+        response = self.http.post(
+            f"{self.ollama_base_url}/embeddings",
+            json={"model": OLLAMA_EMBED_MODEL, "prompt": text}
+        )
+        response.raise_for_status()
+        return np.asarray(orjson.loads(response.content)["embedding"], dtype=np.float32)
+
+    def _embed_prompt(self, user_input):
+        if not self.use_semantic_cache:
+            return None
+        try:
+            vec = self.embed(user_input)
+        except Exception as e:
+            rprint(f"\n[red]Error embedding prompt, semantic cache disabled: {str(e)}[/]")
+            self.use_semantic_cache = False
+            return None
+        norm = _np().linalg.norm(vec)
+        return vec / norm if norm else None
+
+    def _find_similar_response(self, model, query_vec):
+        if query_vec is None or model not in self.semantic_cache:
+            return None
+        cache_vecs, cache_values = self.semantic_cache[model]
+        sims = cache_vecs @ query_vec
+        best = int(sims.argmax())
+        if sims[best] >= SEMANTIC_CACHE_THRESHOLD:
+            return cache_values[best]
+        return None
+
+    def _remember_response(self, model, query_vec, response):
+        if query_vec is None:
+            return
+        if model in self.semantic_cache:
+            cache_vecs, cache_values = self.semantic_cache[model]
+            cache_vecs = _np().vstack([cache_vecs, query_vec])
+        else:
+            cache_vecs, cache_values = query_vec[None, :], []
+        cache_values.append(response)
+        self.semantic_cache[model] = (cache_vecs, cache_values)
+
+    def _reasoning_emitter(self):
+        # Bound once per stream so hidden reasoning costs no per-token branch
+        return self.printer.write if self.show_reasoning else _discard
+
+    def get_deepseek_reasoning(self, user_input):
         # Use Ollama if no official API or explicitly specified
-        if not self.has_official_deepseek or self.use_ollama_deepseek:
+        if not self.uses_official_deepseek():
             return self.get_ollama_deepseek_reasoning(user_input)
         else:
             return self.get_official_deepseek_reasoning(user_input)
 
     def get_official_deepseek_reasoning(self, user_input):
         """Use official Deepseek API for reasoning"""
+        start_time = time.monotonic()
+        
         self.deepseek_messages.append({"role": "user", "content": user_input})
         
         if self.show_reasoning:
             rprint("\n[blue]Reasoning Process[/]")
         
-        response = self.deepseek_client.chat.completions.create(
-            model=DEEPSEEK_MODEL,
-            max_tokens=1,
-            messages=self.deepseek_messages,
-            stream=True
-        )
+        cache_key = self._cache_key(DEEPSEEK_MODEL, self.deepseek_messages)
+        reasoning_content = self._cache_get(cache_key)
+        if reasoning_content is not None:
+            if self.show_reasoning:
+                self.printer.write(reasoning_content)
+        else:
+            response = self.deepseek_client.chat.completions.create(
+                model=DEEPSEEK_MODEL,
+                max_tokens=1,
+                messages=self.deepseek_messages,
+                stream=True
+            )
 
-        reasoning_content = ""
-        final_content = ""
+            reasoning_parts = []
+            emit = self._reasoning_emitter()
 
-        for chunk in response:
-            if chunk.choices[0].delta.reasoning_content:
-                reasoning_piece = chunk.choices[0].delta.reasoning_content
-                reasoning_content += reasoning_piece
-                if self.show_reasoning:
-                    print(reasoning_piece, end="", flush=True)
-            elif chunk.choices[0].delta.content:
-                final_content += chunk.choices[0].delta.content
+            for chunk in response:
+                if chunk.choices[0].delta.reasoning_content:
+                    reasoning_piece = chunk.choices[0].delta.reasoning_content
+                    reasoning_parts.append(reasoning_piece)
+                    emit(reasoning_piece)
+                elif chunk.choices[0].delta.content:
+                    # Reasoning is complete once the answer starts; it is never used
+                    response.close()
+                    break
+            reasoning_content = "".join(reasoning_parts)
+            self._cache_put(cache_key, reasoning_content)
+        self.printer.flush()
 
-        elapsed_time = time.time() - start_time
-        if elapsed_time >= 60:
-            time_str = f"{elapsed_time/60:.1f} minutes"
-        else:
-            time_str = f"{elapsed_time:.1f} seconds"
-        rprint(f"\n\n[yellow]Thought for {time_str}[/]")
+        rprint(f"\n\n[yellow]Thought for {_fmt_elapsed(start_time)}[/]")
         
         if self.show_reasoning:
             print("\n")
@@ -116,7 +474,7 @@ class ModelChain:
 
     def get_ollama_deepseek_reasoning(self, user_input):
         """Use Ollama version of Deepseek for reasoning"""
-        start_time = time.time()
+        start_time = time.monotonic()
         
         if self.show_reasoning:
             rprint("\n[blue]Reasoning Process[/]")
@@ -127,69 +485,69 @@ class ModelChain:
         ]
         
         try:
-            response = requests.post(
-                f"{self.ollama_base_url}/chat",
-                json={
-                    "model": OLLAMA_DEEPSEEK.replace("ollama:", ""),
-                    "messages": messages,
-                    "stream": True
-                },
-                stream=True
-            )
-            
-            reasoning_content = ""
-            current_chunk = ""
-            has_started_think = False
-            
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        chunk = json.loads(line.decode())
-                        if "message" in chunk and "content" in chunk["message"]:
-                            content = chunk["message"]["content"]
-                            current_chunk += content
-                            
-                            # Handle streaming output with tags
-                            if not has_started_think and "<think>" in current_chunk:
-                                has_started_think = True
-                                if self.show_reasoning:
-                                    print("<think>", end="", flush=True)
-                                current_chunk = current_chunk[current_chunk.find("<think>") + 7:]
-                                reasoning_content += "<think>"  # Add opening tag to final content
-                            
-                            if has_started_think:
-                                if "</think>" in current_chunk:
-                                    end_idx = current_chunk.find("</think>")
-                                    if self.show_reasoning:
-                                        print(current_chunk[:end_idx], end="", flush=True)
-                                        print("</think>", end="", flush=True)
-                                    reasoning_content += current_chunk[:end_idx] + "</think>"  # Add content and closing tag
-                                    response.close()  # Close the stream
-                                    break  # Exit the loop after finding </think>
-                                else:
-                                    if self.show_reasoning:
-                                        print(current_chunk, end="", flush=True)
-                                    reasoning_content += current_chunk
-                                    current_chunk = ""
-                                
-                    except json.JSONDecodeError:
-                        continue
+            cache_key = self._cache_key(OLLAMA_DEEPSEEK, messages)
+            reasoning_content = self._cache_get(cache_key)
+            if reasoning_content is not None:
+                if self.show_reasoning:
+                    self.printer.write(reasoning_content)
+            else:
+                reasoning_content = self._stream_ollama_reasoning(messages)
+                self._cache_put(cache_key, reasoning_content)
                     
         except Exception as e:
+            self.printer.flush()
             rprint(f"\n[red]Error in streaming response: {str(e)}[/]")
-            return "Error occurred while streaming response"
+            return STREAM_ERROR
 
-        elapsed_time = time.time() - start_time
-        if elapsed_time >= 60:
-            time_str = f"{elapsed_time/60:.1f} minutes"
-        else:
-            time_str = f"{elapsed_time:.1f} seconds"
-        rprint(f"\n\n[yellow]Thought for {time_str}[/]")
+        self.printer.flush()
+        rprint(f"\n\n[yellow]Thought for {_fmt_elapsed(start_time)}[/]")
         
         if self.show_reasoning:
             print("\n")
         return reasoning_content  # Now includes <think> tags
 
+    def _stream_ollama_reasoning(self, messages):
+        """Stream the <think> block from Ollama Deepseek, printing it as it arrives"""
+        # Let the server stop generating at the closing tag
+        pieces = self._iter_ollama_content(
+            OLLAMA_DEEPSEEK.replace("ollama:", ""),
+            messages,
+            options={"stop": [_ThinkTagScanner.CLOSE_TAG]}
+        )
+        
+        reasoning_parts = []
+        scanner = _ThinkTagScanner()
+        emit = self._reasoning_emitter()
+        
+        for content in pieces:
+            reasoning_piece, _ = scanner.feed(content)
+            if reasoning_piece:
+                emit(reasoning_piece)
+                reasoning_parts.append(reasoning_piece)  # Includes the tags
+            
+            if scanner.done:
+                # Fallback in case the stop sequence was not honored
+                pieces.close()
+                break
+        
+        if scanner.state == scanner.SEEK_OPEN:
+            # With a pre-filled <think> and the stop sequence, no tag is
+            # streamed at all and the whole output is the reasoning
+            untagged = scanner.unparsed()
+            if untagged:
+                reasoning_piece = scanner.OPEN_TAG + untagged + scanner.CLOSE_TAG
+                emit(reasoning_piece)
+                reasoning_parts.append(reasoning_piece)
+            return "".join(reasoning_parts)
+        
+        # The stop sequence itself is not streamed back, so close the tag here
+        reasoning_piece = scanner.finish()
+        if reasoning_piece:
+            emit(reasoning_piece)
+            reasoning_parts.append(reasoning_piece)
+        
+        return "".join(reasoning_parts)
+
     def get_openrouter_response(self, user_input, reasoning):
         combined_prompt = (
             f"<question>{user_input}</question>\n\n"
@@ -201,34 +559,51 @@ class ModelChain:
         rprint(f"[green]{self.get_model_display_name()}[/]")
         
         try:
-            completion = self.openrouter_client.chat.completions.create(
-                model=self.current_model,
-                messages=self.openrouter_messages,
-                stream=True
-            )
-            
-            full_response = ""
-            for chunk in completion:
-                try:
-                    delta = chunk.choices[0].delta
-                    if hasattr(delta, 'content') and delta.content is not None:
-                        content_piece = delta.content
-                        full_response += content_piece
-                        print(content_piece, end="", flush=True)
-                except Exception as e:
-                    rprint(f"\n[red]Error processing chunk: {str(e)}[/]")
-                    continue
-                    
+            cache_key = self._cache_key(self.current_model, self.openrouter_messages)
+            full_response = self._cache_get(cache_key)
+            if full_response is not None:
+                self.printer.write(full_response)
+            else:
+                full_response = self._stream_openrouter_response(self.openrouter_messages)
+                self._cache_put(cache_key, full_response)
+
         except Exception as e:
+            self.printer.flush()
             rprint(f"\n[red]Error in streaming response: {str(e)}[/]")
-            return "Error occurred while streaming response"
+            return STREAM_ERROR
         
+        self.printer.flush()
         self.deepseek_messages.append({"role": "assistant", "content": full_response})
         self.openrouter_messages.append({"role": "assistant", "content": full_response})
         
+        self.compact_history()
+        
         print("\n")
         return full_response
 
+    def _stream_openrouter_response(self, messages):
+        """Stream a response from OpenRouter, printing it as it arrives"""
+        completion = self.openrouter_client.chat.completions.create(
+            model=self.current_model,
+            messages=messages,
+            stream=True
+        )
+        
+        response_parts = []
+        for chunk in completion:
+            try:
+                delta = chunk.choices[0].delta
+                if hasattr(delta, 'content') and delta.content is not None:
+                    content_piece = delta.content
+                    response_parts.append(content_piece)
+                    self.printer.write(content_piece)
+            except Exception as e:
+                self.printer.flush()
+                rprint(f"\n[red]Error processing chunk: {str(e)}[/]")
+                continue
+        
+        return "".join(response_parts)
+
     def get_ollama_response(self, user_input, reasoning):
         combined_prompt = (
             f"<question>{user_input}</question>\n\n"
@@ -243,53 +618,273 @@ class ModelChain:
         rprint(f"[green]{self.get_model_display_name()}[/]")
         
         try:
-            response = requests.post(
-                f"{self.ollama_base_url}/chat",
-                json={
-                    "model": self.current_model.replace("ollama:", ""),
-                    "messages": messages,
-                    "stream": True
-                },
-                stream=True
-            )
+            cache_key = self._cache_key(self.current_model, messages)
+            full_response = self._cache_get(cache_key)
+            if full_response is not None:
+                self.printer.write(full_response)
+            else:
+                full_response = self._stream_ollama_response(messages)
+                self._cache_put(cache_key, full_response)
+
+        except Exception as e:
+            self.printer.flush()
+            rprint(f"\n[red]Error in streaming response: {str(e)}[/]")
+            return STREAM_ERROR
+        
+        self.printer.flush()
+        self.deepseek_messages.append({"role": "assistant", "content": full_response})
+        self.ollama_messages.append({"role": "assistant", "content": full_response})
+        
+        self.compact_history()
+        
+        print("\n")
+        return full_response
+
+    def _stream_ollama_response(self, messages):
+        """Stream a response from Ollama, printing it as it arrives"""
+        response_parts = []
+        for content_piece in self._iter_ollama_content(self.current_model.replace("ollama:", ""), messages):
+            response_parts.append(content_piece)
+            self.printer.write(content_piece)
+        
+        return "".join(response_parts)
+
+    def get_ollama_combined(self, user_input):
+        """Reason and answer with a single request to an Ollama reasoning model
+
+        The model writes its <think> block and then the answer in one stream, so
+        the prompt is evaluated once instead of once per stage.
+        """
+        start_time = time.monotonic()
+        
+        if self.show_reasoning:
+            rprint("\n[blue]Reasoning Process[/]")
+        
+        messages = [
+            {"role": "system", "content": "You are a helpful assistant that thinks step by step. Format your response as: <think>your step by step reasoning</think> followed by a clear and concise answer."},
+            {"role": "user", "content": user_input}
+        ]
+        
+        try:
+            cache_key = self._cache_key(self.current_model, messages)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                pieces = [cached]
+            else:
+                pieces = self._iter_ollama_content(self.current_model.replace("ollama:", ""), messages)
+            
+            reasoning_parts = []
+            response_parts = []
+            # Hidden reasoning is only needed here if it is going into the cache
+            scanner = _ThinkTagScanner(discard_reasoning=not self.show_reasoning and cache_key is None)
+            emit = self._reasoning_emitter()
+            answering = False
+            
+            for content in pieces:
+                reasoning_piece, response_piece = scanner.feed(content)
+                if reasoning_piece:
+                    emit(reasoning_piece)
+                    reasoning_parts.append(reasoning_piece)
+                
+                if scanner.done and not answering:
+                    self._end_combined_reasoning(start_time)
+                    answering = True
+                
+                if response_piece:
+                    self.printer.write(response_piece)
+                    response_parts.append(response_piece)
+            
+            if not answering and scanner.state == scanner.SEEK_OPEN:
+                # The model wrote no think tags at all, so show its raw output
+                # rather than nothing
+                self._end_combined_reasoning(start_time)
+                rprint("[yellow]No <think> block in the model output, showing it unparsed[/]")
+                full_text = scanner.unparsed()
+                self.printer.write(full_text)
+                response_parts.append(full_text)
+            elif not answering:
+                reasoning_piece = scanner.finish()
+                if reasoning_piece:
+                    emit(reasoning_piece)
+                    reasoning_parts.append(reasoning_piece)
+                self._end_combined_reasoning(start_time)
             
-            full_response = ""
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        chunk = json.loads(line.decode())
-                        if "message" in chunk and "content" in chunk["message"]:
-                            content_piece = chunk["message"]["content"]
-                            full_response += content_piece
-                            print(content_piece, end="", flush=True)
-                    except json.JSONDecodeError:
-                        continue
+            reasoning_content = "".join(reasoning_parts)
+            full_response = "".join(response_parts)
+            if cached is None:
+                self._cache_put(cache_key, reasoning_content + full_response)
                     
         except Exception as e:
+            self.printer.flush()
             rprint(f"\n[red]Error in streaming response: {str(e)}[/]")
-            return "Error occurred while streaming response"
+            return STREAM_ERROR
         
+        self.printer.flush()
         self.deepseek_messages.append({"role": "assistant", "content": full_response})
         self.ollama_messages.append({"role": "assistant", "content": full_response})
         
         print("\n")
         return full_response
 
+    def _end_combined_reasoning(self, start_time):
+        # Switch the output from the reasoning block to the answer
+        self.printer.flush()
+        rprint(f"\n\n[yellow]Thought for {_fmt_elapsed(start_time)}[/]")
+        
+        if self.show_reasoning:
+            print("\n")
+        rprint(f"[green]{self.get_model_display_name()}[/]")
+
+    def _iter_ollama_content(self, model, messages, options=None):
+        """Yield message content pieces from a streaming Ollama chat request"""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": True
+        }
+        if options:
+            payload["options"] = options
+        
+        response = self.http.post(f"{self.ollama_base_url}/chat", json=payload, stream=True)
+        try:
+            # Split the raw byte stream on newlines ourselves; chunk_size=None
+            # yields data as soon as it arrives
+            tail = b""
+            for buf in response.iter_content(chunk_size=None):
+                lines = (tail + buf).split(b"\n")
+                tail = lines.pop()
+                for line in lines:
+                    content = self._parse_ollama_line(line)
+                    if content is not None:
+                        yield content
+            content = self._parse_ollama_line(tail)
+            if content is not None:
+                yield content
+        finally:
+            response.close()
+
+    @staticmethod
+    def _parse_ollama_line(line):
+        if not line:
+            return None
+        try:
+            chunk = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            return None
+        if "message" in chunk and "content" in chunk["message"]:
+            return chunk["message"]["content"]
+        return None
+
+    def compact_history(self):
+        """Fold turns older than the recent window into a single summary message
+
+        Only histories that are replayed to a model are compacted; summarizing
+        one that is never sent would just add a blocking call.
+        """
+        if self.uses_official_deepseek():
+            self.deepseek_messages = self._compact_messages(self.deepseek_messages)
+        if not self.uses_ollama_response():
+            self.openrouter_messages = self._compact_messages(self.openrouter_messages)
+
+    def _compact_messages(self, messages):
+        # Compact only once the history reaches twice the window, so the
+        # message prefix stays stable (and cacheable upstream) between compactions
+        keep = 2 * self.history_turns
+        if len(messages) <= 2 * keep:
+            return messages
+        
+        rprint("[magenta]Summarizing earlier conversation...[/]")
+        try:
+            summary = self._summarize_messages(messages[:-keep])
+        except Exception as e:
+            rprint(f"\n[red]Error summarizing chat history: {str(e)}[/]")
+            return messages
+        
+        return [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}] + messages[-keep:]
+
+    def _summarize_messages(self, messages):
+        transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        prompt = [
+            {"role": "system", "content": "Summarize this conversation so the summary can replace it as context. Keep facts, decisions and open questions, and be concise."},
+            {"role": "user", "content": transcript}
+        ]
+        
+        if self.has_openrouter:
+            completion = self.openrouter_client.chat.completions.create(
+                model=OPENROUTER_MODEL,
+                messages=prompt
+            )
+            return completion.choices[0].message.content
+        
+        response = self.http.post(
+            f"{self.ollama_base_url}/chat",
+            json={
+                "model": OLLAMA_MODEL,
+                "messages": prompt,
+                "stream": False
+            }
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)["message"]["content"]
+
+    def uses_official_deepseek(self):
+        return self.has_official_deepseek and not self.use_ollama_deepseek
+
+    def uses_ollama_combined(self):
+        # An Ollama reasoning model can reason and answer in one request
+        return self.current_model.startswith("ollama:") and self.use_ollama_deepseek
+
+    def uses_ollama_response(self):
+        return not self.has_openrouter or self.current_model.startswith("ollama:")
+
+    def preload_ollama_response_model(self):
+        """Load the Ollama response model in the background while reasoning streams"""
+        if not self.uses_ollama_response():
+            return None
+        return self.executor.submit(self._preload_ollama_model, self.current_model.replace("ollama:", ""))
+
+    def _preload_ollama_model(self, model):
+        # An empty chat request makes Ollama load the model without generating.
+        # This runs on the worker thread, so it uses its own one-off request
+        # rather than the session the main thread is streaming on
+        import requests
+        
+        try:
+            requests.post(
+                f"{self.ollama_base_url}/chat",
+                json={"model": model, "messages": []},
+                timeout=60
+            ).close()
+        except requests.RequestException:
+            pass
+
     def get_response(self, user_input, reasoning):
         # Use Ollama response if no OpenRouter API or if using Ollama model
-        if not self.has_openrouter or self.current_model.startswith("ollama:"):
+        if self.uses_ollama_response():
             return self.get_ollama_response(user_input, reasoning)
         else:
             return self.get_openrouter_response(user_input, reasoning)
 
 def main():
-    chain = ModelChain()
+    parser = argparse.ArgumentParser(description="Retrieval augmented thinking")
+    parser.add_argument("--cache", action="store_true", help="replay identical requests from the on-disk cache")
+    parser.add_argument("--plain", action="store_true", help="read input with plain input() instead of prompt_toolkit")
+    args = parser.parse_args()
     
-    # Initialize prompt session with styling
-    style = Style.from_dict({
-        'prompt': 'orange bold',
-    })
-    session = PromptSession(style=style)
+    chain = ModelChain(use_cache=args.cache)
+    
+    if args.plain:
+        read_input = input
+    else:
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.styles import Style
+        
+        # Initialize prompt session with styling
+        style = Style.from_dict({
+            'prompt': 'orange bold',
+        })
+        session = PromptSession(style=style)
+        read_input = session.prompt
     
     rprint(Panel.fit(
         "[bold cyan]Retrival augmented thinking[/]",
@@ -307,42 +902,45 @@ def main():
         rprint(" • For Ollama models, use [bold magenta]'model ollama:<model_name>'[/]")
     if not chain.has_official_deepseek:
         rprint(" • Using Ollama Deepseek (no official API key found)")
+    if chain.cache is not None:
+        rprint(f" • Caching responses in {chain.cache.directory}")
     rprint("\n")
     
     while True:
         try:
-            user_input = session.prompt("\nYou: ", style=style).strip()
+            user_input = read_input("\nYou: ").strip()
+            # Lowercase only a short prefix; commands are short but prompts can be huge
+            cmd = user_input[:64].lower()
             
-            if user_input.lower() == 'quit':
+            if cmd == 'quit':
                 print("\nGoodbye! 👋")
                 break
 
-            if user_input.lower() == 'clear':
-                chain.deepseek_messages = []
-                chain.openrouter_messages = []
-                chain.ollama_messages = []
+            if cmd == 'clear':
+                chain.clear_history()
                 rprint("\n[magenta]Chat history cleared![/]\n")
                 continue
                 
-            if user_input.lower().startswith('model '):
+            if cmd.startswith('model '):
                 new_model = user_input[6:].strip()
                 chain.set_model(new_model)
                 print(f"\nChanged model to: {chain.get_model_display_name()}\n")
                 continue
 
-            if user_input.lower() == 'reasoning':
+            if cmd == 'reasoning':
                 chain.show_reasoning = not chain.show_reasoning
                 status = "visible" if chain.show_reasoning else "hidden"
                 rprint(f"\n[magenta]Reasoning process is now {status}[/]\n")
                 continue
             
-            reasoning = chain.get_deepseek_reasoning(user_input)
-            response = chain.get_response(user_input, reasoning)
+            chain.answer(user_input)
             
         except KeyboardInterrupt:
             continue
         except EOFError:
             break
+    
+    chain.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file